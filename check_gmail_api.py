@@ -4,12 +4,7 @@ Check Gmail API status and provide fixes
 """
 
 import os
-import json
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import orjson
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
@@ -24,10 +19,17 @@ def check_gmail_api():
         print("Please download your Gmail API credentials from Google Cloud Console")
         return False
     
+    # Google client libraries are slow to import, load them only once they are needed
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+    
     try:
         # Load credentials
-        with open('credentials.json', 'r') as f:
-            creds_data = json.load(f)
+        with open('credentials.json', 'rb') as f:
+            creds_data = orjson.loads(f.read())
         
         # Extract project ID
         if 'installed' in creds_data:
@@ -7,7 +7,7 @@ This script demonstrates how to use the GmailAISummarizer class programmatically
 import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from gmail_ai_summarizer import GmailAISummarizer
+from gmail_core import GmailAISummarizer
 
 def main():
     """Demo the Gmail AI Summarizer functionality"""
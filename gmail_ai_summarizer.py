@@ -1,282 +1,50 @@
 import os
-import base64
-import re
-import json
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
-import urllib.parse
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from typing import List, Dict, Tuple
 
 import streamlit as st
 import pandas as pd
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import openai
-from bs4 import BeautifulSoup
-import requests
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from gmail_core import GmailAISummarizer
 
-# Gmail API scopes
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+# Fetch results are reused for five minutes
+FETCH_CACHE_TTL = 300
 
-class GmailAISummarizer:
-    def __init__(self):
-        self.service = None
-        self.openai_client = None
-        self.setup_openai()
-    
-    def setup_openai(self):
-        """Setup OpenAI client"""
-        api_key = os.getenv('OPENAI_API_KEY')
-        if api_key:
-            self.openai_client = openai.OpenAI(api_key=api_key)
-        else:
-            st.error("OpenAI API key not found. Please set OPENAI_API_KEY in your .env file")
-    
-    def authenticate_gmail(self):
-        """Authenticate with Gmail API"""
-        creds = None
-        
-        # Check if token.json exists
-        if os.path.exists('token.json'):
-            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-        
-        # If no valid credentials, let user log in
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                # Check if credentials.json exists
-                if not os.path.exists('credentials.json'):
-                    st.error("""
-                    Please download your Gmail API credentials:
-                    1. Go to Google Cloud Console
-                    2. Create a new project or select existing one
-                    3. Enable Gmail API
-                    4. Create credentials (OAuth 2.0 Client ID)
-                    5. Download as credentials.json
-                    6. Place it in this directory
-                    """)
-                    return False
-                
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-            
-            # Save credentials for next run
-            with open('token.json', 'w') as token:
-                token.write(creds.to_json())
-        
-        try:
-            self.service = build('gmail', 'v1', credentials=creds)
-            return True
-        except Exception as e:
-            st.error(f"Error building Gmail service: {e}")
-            return False
-    
-    def extract_urls_from_text(self, text: str) -> List[str]:
-        """Extract URLs from text content"""
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        urls = re.findall(url_pattern, text)
-        return list(set(urls))  # Remove duplicates
-    
-    def clean_email_content(self, content: str) -> str:
-        """Clean and extract text content from email"""
-        if not content:
-            return ""
-        
-        # Decode base64 if needed
-        try:
-            content = base64.urlsafe_b64decode(content).decode('utf-8')
-        except:
-            pass
-        
-        # Parse HTML and extract text
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        # Get text content
-        text = soup.get_text()
-        
-        # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
-        
-        return text
-    
-    def get_email_content(self, message_id: str) -> Tuple[str, str, str, str]:
-        """Get email content, subject, sender, and date"""
-        try:
-            message = self.service.users().messages().get(userId='me', id=message_id).execute()
-            
-            headers = message['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-            
-            # Extract body content
-            body = ""
-            if 'parts' in message['payload']:
-                for part in message['payload']['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        body = part['body'].get('data', '')
-                        break
-                    elif part['mimeType'] == 'text/html':
-                        body = part['body'].get('data', '')
-            else:
-                body = message['payload']['body'].get('data', '')
-            
-            cleaned_content = self.clean_email_content(body)
-            return cleaned_content, subject, sender, date
-            
-        except Exception as e:
-            st.error(f"Error getting email content: {e}")
-            return "", "", "", ""
-    
-    def summarize_with_ai(self, content: str, subject: str) -> Dict:
-        """Summarize email content using OpenAI"""
-        if not self.openai_client or not content.strip():
-            return {
-                'summary': 'No content to summarize or OpenAI not configured',
-                'key_points': [],
-                'action_items': [],
-                'sentiment': 'neutral'
-            }
-        
-        try:
-            prompt = f"""
-            Please analyze this email and provide:
-            1. A concise summary (2-3 sentences)
-            2. Key points (bullet points)
-            3. Action items if any
-            4. Sentiment (positive/negative/neutral)
-            
-            Subject: {subject}
-            Content: {content[:3000]}  # Limit content length
-            
-            Format your response as JSON:
-            {{
-                "summary": "brief summary",
-                "key_points": ["point1", "point2"],
-                "action_items": ["action1", "action2"],
-                "sentiment": "positive/negative/neutral"
-            }}
-            """
-            
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500,
-                temperature=0.3
-            )
-            
-            result = json.loads(response.choices[0].message.content)
-            return result
-            
-        except Exception as e:
-            st.error(f"Error in AI summarization: {e}")
-            return {
-                'summary': f'Error in summarization: {str(e)}',
-                'key_points': [],
-                'action_items': [],
-                'sentiment': 'neutral'
-            }
+@st.cache_resource
+def get_summarizer() -> GmailAISummarizer:
+    """Summarizer shared across reruns, so the Gmail service is built once"""
+    return GmailAISummarizer(error_handler=st.error)
+
+@st.cache_resource
+def get_fetch_cache() -> Dict[Tuple[str, int, bool], Tuple[float, List[Dict]]]:
+    """Fetch results by (query, max_results, summarize), shared across reruns and sessions"""
+    return {}
+
+def cached_fetch(query: str, max_results: int, summarize: bool = True) -> List[Dict]:
+    """Fetch and analyze emails, reusing complete results for five minutes"""
+    cache = get_fetch_cache()
+    key = (query, max_results, summarize)
+    now = time.monotonic()
     
-    def fetch_emails(self, query: str = "", max_results: int = 50) -> List[Dict]:
-        """Fetch emails based on query"""
-        if not self.service:
-            st.error("Gmail service not initialized. Please authenticate first.")
-            return []
-            
-        try:
-            results = self.service.users().messages().list(
-                userId='me', 
-                q=query, 
-                maxResults=max_results
-            ).execute()
-            
-            messages = results.get('messages', [])
-            emails = []
-            
-            for message in messages:
-                content, subject, sender, date = self.get_email_content(message['id'])
-                urls = self.extract_urls_from_text(content)
-                
-                # AI summarization
-                ai_summary = self.summarize_with_ai(content, subject)
-                
-                email_data = {
-                    'id': message['id'],
-                    'subject': subject,
-                    'sender': sender,
-                    'date': date,
-                    'content': content[:500] + "..." if len(content) > 500 else content,
-                    'urls': urls,
-                    'summary': ai_summary['summary'],
-                    'key_points': ai_summary['key_points'],
-                    'action_items': ai_summary['action_items'],
-                    'sentiment': ai_summary['sentiment']
-                }
-                emails.append(email_data)
-            
-            return emails
-            
-        except Exception as e:
-            st.error(f"Error fetching emails: {e}")
-            return []
+    if key in cache and now - cache[key][0] < FETCH_CACHE_TTL:
+        emails = cache[key][1]
+        for email in emails:
+            st.write(f"📧 **{email['subject']}** — {email['summary']}")
+        return emails
     
-    def get_date_range_query(self, start_date: str, end_date: str) -> str:
-        """Create Gmail query for date range"""
-        return f"after:{start_date} before:{end_date}"
+    emails = []
+    for email in get_summarizer().iter_emails(query, max_results, summarize):
+        emails.append(email)
+        # Shown as each summary completes
+        st.write(f"📧 **{email['subject']}** — {email['summary']}")
     
-    def create_digest(self, emails: List[Dict]) -> Dict:
-        """Create a comprehensive digest of emails"""
-        if not emails:
-            return {}
-        
-        # Extract all URLs
-        all_urls = []
-        for email in emails:
-            all_urls.extend(email['urls'])
-        
-        # Count sentiments
-        sentiment_counts = {}
-        for email in emails:
-            sentiment = email['sentiment']
-            sentiment_counts[sentiment] = sentiment_counts.get(sentiment, 0) + 1
-        
-        # Collect all action items
-        all_action_items = []
-        for email in emails:
-            all_action_items.extend(email['action_items'])
-        
-        # Top senders
-        sender_counts = {}
-        for email in emails:
-            sender = email['sender']
-            sender_counts[sender] = sender_counts.get(sender, 0) + 1
-        
-        return {
-            'total_emails': len(emails),
-            'unique_urls': list(set(all_urls)),
-            'sentiment_distribution': sentiment_counts,
-            'action_items': all_action_items,
-            'top_senders': sorted(sender_counts.items(), key=lambda x: x[1], reverse=True)[:5],
-            'date_range': {
-                'start': emails[-1]['date'] if emails else None,
-                'end': emails[0]['date'] if emails else None
-            }
-        }
+    # Empty or partly failed results aren't kept, so the next click retries them
+    if emails and not any(email['summary_failed'] for email in emails):
+        for stale_key in [k for k, (stored_at, _) in cache.items() if now - stored_at >= FETCH_CACHE_TTL]:
+            cache.pop(stale_key, None)
+        cache[key] = (now, emails)
+    return emails
 
 def main():
     st.set_page_config(
@@ -289,7 +57,7 @@ def main():
     st.markdown("---")
     
     # Initialize the summarizer
-    summarizer = GmailAISummarizer()
+    summarizer = get_summarizer()
     
     # Sidebar for configuration
     st.sidebar.header("Configuration")
@@ -308,7 +76,6 @@ def main():
             if summarizer.authenticate_gmail():
                 st.sidebar.success("✅ Gmail authenticated successfully!")
                 st.session_state.authenticated = True
-                st.session_state.summarizer = summarizer
                 st.rerun()
             else:
                 st.sidebar.error("❌ Gmail authentication failed!")
@@ -339,6 +106,11 @@ def main():
     )
     
     max_results = st.sidebar.slider("Max emails to fetch:", 10, 100, 50)
+    summarize = st.sidebar.checkbox(
+        "🤖 Summarize with AI",
+        value=True,
+        help="Turn off to list subjects, senders and dates only, without downloading email bodies"
+    )
     
     query = ""
     if fetch_option == "Date range":
@@ -358,23 +130,28 @@ def main():
     
     # Fetch emails button
     if st.sidebar.button("📥 Fetch Emails"):
-        with st.spinner("Fetching and analyzing emails..."):
-            # Use the authenticated summarizer from session state
-            if hasattr(st.session_state, 'summarizer'):
-                emails = st.session_state.summarizer.fetch_emails(query, max_results)
-            else:
-                emails = summarizer.fetch_emails(query, max_results)
+        with st.status("Fetching and analyzing emails...") as status:
+            emails = cached_fetch(query, max_results, summarize)
+            status.update(label=f"Analyzed {len(emails)} emails", state="complete", expanded=False)
+        
+        if emails:
+            st.session_state.emails = emails
+            st.session_state.digest = summarizer.create_digest(emails)
             
-            if emails:
-                st.session_state.emails = emails
-                st.session_state.digest = summarizer.create_digest(emails)
-                st.success(f"✅ Fetched and analyzed {len(emails)} emails!")
-            else:
-                st.error("No emails found or error occurred.")
+            # Columnar copy for the analytics, with Arrow-backed string columns
+            emails_df = pd.DataFrame(emails)
+            text_columns = ['subject', 'sender', 'date', 'content']
+            emails_df[text_columns] = emails_df[text_columns].astype('string[pyarrow]')
+            emails_df['ts'] = pd.to_datetime(emails_df['ts'], utc=True, errors='coerce')
+            st.session_state.emails_df = emails_df
+            st.success(f"✅ Fetched and analyzed {len(emails)} emails!")
+        else:
+            st.error("No emails found or error occurred.")
     
     # Display results
     if hasattr(st.session_state, 'emails') and st.session_state.emails:
         emails = st.session_state.emails
+        emails_df = st.session_state.emails_df
         digest = st.session_state.digest
         
         # Tabs for different views
@@ -426,12 +203,12 @@ def main():
             
             filtered_emails = emails
             if search_term:
-                filtered_emails = [
-                    email for email in emails
-                    if search_term.lower() in email['subject'].lower() or
-                       search_term.lower() in email['sender'].lower() or
-                       search_term.lower() in email['content'].lower()
-                ]
+                mask = (
+                    emails_df['subject'].str.contains(search_term, case=False, na=False, regex=False) |
+                    emails_df['sender'].str.contains(search_term, case=False, na=False, regex=False) |
+                    emails_df['content'].str.contains(search_term, case=False, na=False, regex=False)
+                )
+                filtered_emails = [emails[i] for i in emails_df.index[mask]]
             
             for i, email in enumerate(filtered_emails):
                 with st.expander(f"📧 {email['subject']} - {email['sender']}"):
@@ -487,37 +264,20 @@ def main():
             
             # Email volume over time
             st.subheader("Email Volume by Date")
-            date_counts = {}
-            for email in emails:
-                try:
-                    date = email['date'][:10]  # Extract date part
-                    date_counts[date] = date_counts.get(date, 0) + 1
-                except:
-                    pass
+            date_counts = emails_df['ts'].dt.floor('D').value_counts().sort_index()
             
-            if date_counts:
-                date_df = pd.DataFrame(
-                    list(date_counts.items()),
-                    columns=['Date', 'Email Count']
-                ).sort_values('Date')
-                st.line_chart(date_df.set_index('Date'))
+            if not date_counts.empty:
+                st.line_chart(date_counts.rename('Email Count').rename_axis('Date'))
             
             # URL analysis
             st.subheader("URL Analysis")
-            url_domains = {}
-            for url in digest['unique_urls']:
-                try:
-                    domain = urllib.parse.urlparse(url).netloc
-                    url_domains[domain] = url_domains.get(domain, 0) + 1
-                except:
-                    pass
+            # Domains were parsed at fetch time, count each unique URL once
+            unique_urls = emails_df[['urls', 'url_domains']].explode(['urls', 'url_domains'])
+            unique_urls = unique_urls.dropna().drop_duplicates('urls')
+            url_domains = unique_urls['url_domains'].value_counts()
             
-            if url_domains:
-                domain_df = pd.DataFrame(
-                    list(url_domains.items()),
-                    columns=['Domain', 'URL Count']
-                ).sort_values('URL Count', ascending=False)
-                st.bar_chart(domain_df.set_index('Domain'))
+            if not url_domains.empty:
+                st.bar_chart(url_domains.rename('URL Count').rename_axis('Domain'))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,614 @@
+"""
+Gmail AI Summarizer core
+Fetches, parses and summarizes emails without any Streamlit dependency.
+"""
+
+import os
+import asyncio
+import base64
+import re
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import chain
+from typing import Any, Callable, List, Dict, Iterator, Optional, Tuple
+import urllib.parse
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.utils import parsedate_to_datetime
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+import google_auth_httplib2
+import diskcache
+import orjson
+from selectolax.parser import HTMLParser
+from dotenv import load_dotenv
+
+try:
+    # RE2 matches in linear time, so long junk tokens in HTML mail can't make URL matching blow up
+    import re2
+except ImportError:
+    re2 = re
+
+# Load environment variables
+load_dotenv()
+
+# Gmail API scopes
+SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+# Gmail accepts at most 100 calls in a single batch request
+BATCH_SIZE = 100
+
+# Gmail returns at most 500 message ids per list page
+LIST_PAGE_SIZE = 500
+
+# Headers requested when the message body isn't needed
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+
+# Maximum number of OpenAI requests in flight at once
+MAX_CONCURRENT_SUMMARIES = 16
+
+# Refresh the access token once it is this close to expiring
+TOKEN_EXPIRY_MARGIN = timedelta(seconds=60)
+
+# URLs end at whitespace, quotes, angle brackets or parentheses
+URL_PATTERN = re2.compile(r'https?://[^\s<>"\'()]+')
+
+# OpenAI model used for summaries; bump the prompt version when the prompt changes
+OPENAI_MODEL = "gpt-4o-mini"
+SUMMARY_PROMPT_VERSION = "v3"
+
+SUMMARY_SYSTEM_PROMPT = (
+    'Each <email idx="N"> block is one email. Return only JSON of the form {"results": [...]} '
+    "with one object per email, each with keys idx, summary (2-3 sentences), "
+    "key_points (list of strings), action_items (list of strings) and "
+    "sentiment (positive, negative or neutral)."
+)
+
+# Emails packed into one OpenAI request, and the input tokens they share
+SUMMARY_BATCH_SIZE = 5
+SUMMARY_BATCH_TOKENS = 12000
+
+# Rough token size used when tiktoken's encoding can't be loaded
+CHARS_PER_TOKEN = 4
+
+# Emails shorter than this are their own summary
+SHORT_EMAIL_CHARS = 120
+
+# Bulk mail is recognised by an unsubscribe link near the top
+NEWSLETTER_MARKER = 'unsubscribe'
+
+# On-disk cache of AI summaries, entries expire after 30 days
+SUMMARY_CACHE_DIR = '.summarycache'
+SUMMARY_CACHE_EXPIRE = 30 * 24 * 60 * 60
+
+def build_service(creds: Credentials):
+    """Gmail service whose calls all go through one keep-alive connection"""
+    authed_http = google_auth_httplib2.AuthorizedHttp(creds, http=build_http())
+    return build('gmail', 'v1', http=authed_http, cache_discovery=False)
+
+def extract_urls(text: str) -> List[str]:
+    """Unique URLs in text, with trailing punctuation stripped"""
+    return list({match.group(0).rstrip('.,);:]') for match in URL_PATTERN.finditer(text)})
+
+def url_domain(url: str) -> str:
+    """Domain of a URL, empty when the URL can't be parsed"""
+    try:
+        return urllib.parse.urlsplit(url).netloc
+    except ValueError:
+        return ''
+
+def walk_parts(parts: List[Dict]):
+    """Yield the leaf parts of a nested MIME tree"""
+    for part in parts:
+        if part.get('parts'):
+            yield from walk_parts(part['parts'])
+        else:
+            yield part
+
+def parse_headers(message: Dict) -> Tuple[str, str, str]:
+    """Subject, sender and date of a fetched message"""
+    # Header names are case-insensitive, built in reverse so a repeated header keeps its first value
+    headers = {h['name'].lower(): h['value'] for h in reversed(message['payload']['headers'])}
+    return (
+        headers.get('subject', 'No Subject'),
+        headers.get('from', 'Unknown Sender'),
+        headers.get('date', 'Unknown Date')
+    )
+
+def decode_body(payload: Dict) -> Tuple[bytes, bool]:
+    """Decoded message body, preferring text/plain over text/html, and whether it is HTML"""
+    if 'parts' in payload:
+        parts = list(walk_parts(payload['parts']))
+        part = (next((p for p in parts if p.get('mimeType') == 'text/plain'), None) or
+                next((p for p in parts if p.get('mimeType') == 'text/html'), None))
+    else:
+        part = payload
+    
+    # Fields without data are left out of partial responses
+    body = part.get('body', {}).get('data', '') if part else ''
+    is_html = part is not None and part.get('mimeType') != 'text/plain'
+    
+    # Gmail always sends body data as base64url, padding is not guaranteed
+    return base64.urlsafe_b64decode(body + '=' * (-len(body) % 4)), is_html
+
+def get_message_request(service, message_id: str, metadata_only: bool = False, fields: Optional[str] = None):
+    """Build a messages.get request, asking only for headers when the body isn't needed"""
+    messages = service.users().messages()
+    if metadata_only:
+        return messages.get(
+            userId='me',
+            id=message_id,
+            format='metadata',
+            metadataHeaders=METADATA_HEADERS,
+            fields='id,payload/headers'
+        )
+    return messages.get(userId='me', id=message_id, format='full', fields=fields)
+
+def batch_get_messages(service, requests: Dict[str, Any], parse: Callable[[Dict], Any],
+                       error_handler: Callable[[str], None],
+                       fallback: Optional[Callable[[List[str]], Dict]] = None) -> Dict:
+    """Run messages.get requests keyed by message id, BATCH_SIZE per HTTP round-trip, and parse each response"""
+    parsed = {}
+    
+    def handle_response(request_id, response, exception):
+        if exception is not None:
+            error_handler(f"Error getting email content: {exception}")
+            return
+        try:
+            parsed[request_id] = parse(response)
+        except Exception as e:
+            error_handler(f"Error getting email content: {e}")
+    
+    items = list(requests.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        chunk = items[start:start + BATCH_SIZE]
+        batch = service.new_batch_http_request(callback=handle_response)
+        for message_id, request in chunk:
+            batch.add(request, request_id=message_id)
+        try:
+            batch.execute()
+        except HttpError as e:
+            # Rate limits (429, 403) are re-raised, separate requests would only make them worse
+            if fallback is None or not (e.resp.status == 404 or e.resp.status >= 500):
+                raise
+            # Batch endpoint unavailable, fetch this chunk's messages another way
+            parsed.update(fallback([message_id for message_id, _ in chunk]))
+    
+    return parsed
+
+class GmailAISummarizer:
+    # Gmail service shared across instances so its HTTP connection is reused
+    _service_cache = None
+    # OAuth credentials shared across instances so they are refreshed only once
+    _creds_cache = None
+    # httplib2 isn't thread-safe, so Streamlit sessions sharing the service take turns with it
+    _service_lock = threading.Lock()
+    
+    def __init__(self, error_handler: Optional[Callable[[str], None]] = None):
+        # Errors are printed unless the caller shows them elsewhere, e.g. st.error
+        self.error_handler = error_handler or print
+        self.service = GmailAISummarizer._service_cache
+        self.openai_client = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._encoding = None
+        self._email_token_budget = None
+        # OpenAI client and summary cache are set up on first summarization
+        self._summary_cache = None
+        # Summaries by content hash, shared by identical emails
+        self._content_hash_cache = {}
+    
+    def setup_openai(self):
+        """Setup OpenAI client"""
+        api_key = os.getenv('OPENAI_API_KEY')
+        if api_key:
+            # Imported here, openai alone takes most of a second to load
+            import openai
+            self.openai_client = openai.AsyncOpenAI(api_key=api_key)
+        else:
+            self.error_handler("OpenAI API key not found. Please set OPENAI_API_KEY in your .env file")
+    
+    @staticmethod
+    def _creds_fresh(creds: Optional[Credentials]) -> bool:
+        """Check that credentials stay valid for at least TOKEN_EXPIRY_MARGIN"""
+        if not creds or not creds.valid:
+            return False
+        return creds.expiry is None or creds.expiry - datetime.utcnow() > TOKEN_EXPIRY_MARGIN
+    
+    def authenticate_gmail(self):
+        """Authenticate with Gmail API"""
+        creds = GmailAISummarizer._creds_cache
+        
+        # Already authenticated with a fresh token, nothing to do
+        if self._creds_fresh(creds) and GmailAISummarizer._service_cache:
+            self.service = GmailAISummarizer._service_cache
+            return True
+        
+        # Check if token.json exists
+        saved_token = None
+        if not creds and os.path.exists('token.json'):
+            with open('token.json', 'r') as token:
+                saved_token = token.read()
+            creds = Credentials.from_authorized_user_info(orjson.loads(saved_token), SCOPES)
+        
+        # If no fresh credentials, refresh them or let user log in
+        if not self._creds_fresh(creds):
+            if creds and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                # Check if credentials.json exists
+                if not os.path.exists('credentials.json'):
+                    self.error_handler("""
+                    Please download your Gmail API credentials:
+                    1. Go to Google Cloud Console
+                    2. Create a new project or select existing one
+                    3. Enable Gmail API
+                    4. Create credentials (OAuth 2.0 Client ID)
+                    5. Download as credentials.json
+                    6. Place it in this directory
+                    """)
+                    return False
+                
+                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+                creds = flow.run_local_server(port=0)
+            
+        # Save credentials for next run, only if they changed
+        token_json = creds.to_json()
+        if token_json != saved_token:
+            with open('token.json', 'w') as token:
+                token.write(token_json)
+        
+        try:
+            self.service = build_service(creds)
+            GmailAISummarizer._service_cache = self.service
+            GmailAISummarizer._creds_cache = creds
+            return True
+        except Exception as e:
+            self.error_handler(f"Error building Gmail service: {e}")
+            return False
+    
+    def extract_urls_from_text(self, text: str) -> List[str]:
+        """Extract URLs from text content"""
+        return extract_urls(text)
+    
+    def clean_email_content(self, content: bytes, is_html: bool = True) -> str:
+        """Clean and extract text content from a decoded email body"""
+        if not content:
+            return ""
+        
+        # Parse HTML and extract text, plain text needs no parsing
+        if is_html:
+            # The parser takes bytes directly and detects the charset itself
+            tree = HTMLParser(content)
+            
+            # Remove script and style elements
+            for node in tree.css('script, style'):
+                node.decompose()
+            
+            text = tree.text(separator=' ')
+        else:
+            text = content.decode('utf-8', errors='replace')
+        
+        # Clean up whitespace
+        return ' '.join(text.split())
+    
+    def _parse_message(self, message: Dict, metadata_only: bool = False) -> Tuple[str, str, str, str]:
+        """Extract content, subject, sender, and date from a fetched message"""
+        subject, sender, date = parse_headers(message)
+        
+        if metadata_only:
+            return "", subject, sender, date
+        
+        raw, is_html = decode_body(message['payload'])
+        cleaned_content = self.clean_email_content(raw, is_html)
+        return cleaned_content, subject, sender, date
+    
+    def get_email_content(self, message_id: str, metadata_only: bool = False) -> Tuple[str, str, str, str]:
+        """Get email content, subject, sender, and date"""
+        try:
+            with GmailAISummarizer._service_lock:
+                message = get_message_request(self.service, message_id, metadata_only).execute()
+            return self._parse_message(message, metadata_only)
+            
+        except Exception as e:
+            self.error_handler(f"Error getting email content: {e}")
+            return "", "", "", ""
+    
+    def _batch_get_messages(self, message_ids: List[str],
+                            metadata_only: bool = False) -> Dict[str, Tuple[str, str, str, str]]:
+        """Fetch and parse messages, up to BATCH_SIZE per HTTP round-trip"""
+        return batch_get_messages(
+            self.service,
+            {message_id: get_message_request(self.service, message_id, metadata_only)
+             for message_id in message_ids},
+            partial(self._parse_message, metadata_only=metadata_only),
+            self.error_handler
+        )
+    
+    def _run(self, coro):
+        """Run a coroutine on this instance's event loop"""
+        # Reuse one loop so the async OpenAI client's pooled connections stay valid
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+            return self._loop.run_until_complete(coro)
+    
+    def summarize_with_ai(self, content: str, subject: str, message_id: str = "") -> Dict:
+        """Summarize email content using OpenAI"""
+        return self._run(self._summarize_all([(message_id, content, subject)]))[0]
+    
+    def _summary_cache_key(self, message_id: str, content_hash: str) -> str:
+        """Cache key for a summary; the content hash catches edited drafts"""
+        return f"{message_id}:{OPENAI_MODEL}:{SUMMARY_PROMPT_VERSION}:{content_hash}"
+    
+    def _quick_summary(self, content: str, subject: str) -> Optional[Dict]:
+        """Templated summary for emails not worth an OpenAI request"""
+        if len(content) < SHORT_EMAIL_CHARS:
+            return self._empty_summary(content)
+        if NEWSLETTER_MARKER in content[:1000].lower():
+            return self._empty_summary(f"Newsletter: {subject}")
+        return None
+    
+    @staticmethod
+    def _empty_summary(summary: str, failed: bool = False) -> Dict:
+        """Summary placeholder used when no AI summary is available, failed when worth retrying"""
+        return {
+            'summary': summary,
+            'key_points': [],
+            'action_items': [],
+            'sentiment': 'neutral',
+            'failed': failed
+        }
+    
+    async def _summarize_all(self, items: List[Tuple[str, str, str]]) -> List[Dict]:
+        """Summarize (message_id, content, subject) triples, reusing cached summaries"""
+        summaries = [None] * len(items)
+        async for i, summary in self._iter_summaries(items):
+            summaries[i] = summary
+        return summaries
+    
+    async def _iter_summaries(self, items: List[Tuple[str, str, str]]):
+        """Yield (index, summary) pairs for the items as each summary becomes available"""
+        if self.openai_client is None:
+            self.setup_openai()
+        if self._summary_cache is None:
+            self._summary_cache = diskcache.Cache(SUMMARY_CACHE_DIR)
+        
+        # Emails that need OpenAI, grouped so identical content is summarized once
+        pending = {}
+        
+        for i, (message_id, content, subject) in enumerate(items):
+            if not content.strip():
+                yield i, self._empty_summary('No content to summarize')
+                continue
+            
+            quick_summary = self._quick_summary(content, subject)
+            if quick_summary is not None:
+                yield i, quick_summary
+                continue
+            
+            if not self.openai_client:
+                yield i, self._empty_summary('OpenAI not configured', failed=True)
+                continue
+            
+            content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            if content_hash in self._content_hash_cache:
+                yield i, self._content_hash_cache[content_hash]
+                continue
+            
+            cache_key = self._summary_cache_key(message_id, content_hash)
+            cached = self._summary_cache.get(cache_key)
+            if cached is not None:
+                self._content_hash_cache[content_hash] = cached
+                yield i, cached
+            elif content_hash in pending:
+                pending[content_hash][0].append((i, cache_key))
+            else:
+                pending[content_hash] = ([(i, cache_key)], content, subject)
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SUMMARIES)
+        
+        async def summarize(batch):
+            try:
+                async with semaphore:
+                    results = await self._summarize_batch(
+                        [(content, subject) for _, (_, content, subject) in batch]
+                    )
+            except Exception as e:
+                self.error_handler(f"Error in AI summarization: {e}")
+                error = self._empty_summary(f'Error in summarization: {str(e)}', failed=True)
+                return [(i, error) for _, (targets, _, _) in batch for i, _ in targets]
+            
+            summaries = []
+            for (content_hash, (targets, _, _)), result in zip(batch, results):
+                if result is None:
+                    result = self._empty_summary('No summary returned for this email', failed=True)
+                else:
+                    self._content_hash_cache[content_hash] = result
+                    for _, cache_key in targets:
+                        self._summary_cache.set(cache_key, result, expire=SUMMARY_CACHE_EXPIRE)
+                summaries.extend((i, result) for i, _ in targets)
+            return summaries
+        
+        pending = list(pending.items())
+        batches = [pending[start:start + SUMMARY_BATCH_SIZE]
+                   for start in range(0, len(pending), SUMMARY_BATCH_SIZE)]
+        for done in asyncio.as_completed([summarize(batch) for batch in batches]):
+            for i, summary in await done:
+                yield i, summary
+    
+    def _truncate(self, text: str) -> str:
+        """Cut text down to one email's share of the batch token budget"""
+        if self._email_token_budget is None:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+                prompt_tokens = len(self._encoding.encode(SUMMARY_SYSTEM_PROMPT))
+            except Exception:
+                # tiktoken downloads its BPE file on first use, estimate when offline
+                prompt_tokens = len(SUMMARY_SYSTEM_PROMPT) // CHARS_PER_TOKEN
+            self._email_token_budget = (SUMMARY_BATCH_TOKENS - prompt_tokens) // SUMMARY_BATCH_SIZE
+        
+        if self._encoding is None:
+            return text[:self._email_token_budget * CHARS_PER_TOKEN]
+        
+        tokens = self._encoding.encode(text)
+        if len(tokens) <= self._email_token_budget:
+            return text
+        return self._encoding.decode(tokens[:self._email_token_budget])
+    
+    async def _summarize_batch(self, items: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        """Summarize several (content, subject) pairs with a single OpenAI request"""
+        blocks = []
+        for idx, (content, subject) in enumerate(items):
+            text = self._truncate(f"Subject: {subject}\n\n{content}")
+            blocks.append(f'<email idx="{idx}">\n{text}\n</email>')
+        emails = "\n\n".join(blocks)
+        
+        response = await self.openai_client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": emails}
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=500 * len(items),
+            temperature=0.3
+        )
+        
+        # JSON mode guarantees valid JSON, not that every email or key is present
+        data = orjson.loads(response.choices[0].message.content)
+        results = [None] * len(items)
+        for position, entry in enumerate(data.get('results', [])):
+            idx = entry.get('idx', position)
+            if str(idx).isdigit() and int(idx) < len(items):
+                results[int(idx)] = {
+                    'summary': entry.get('summary', ''),
+                    'key_points': entry.get('key_points', []),
+                    'action_items': entry.get('action_items', []),
+                    'sentiment': entry.get('sentiment', 'neutral')
+                }
+        return results
+    
+    @staticmethod
+    def _parse_date(date: str) -> Optional[datetime]:
+        """Parse an RFC 2822 Date header, None if it can't be parsed"""
+        try:
+            return parsedate_to_datetime(date)
+        except (TypeError, ValueError):
+            return None
+    
+    def _list_message_ids(self, query: str, max_results: int) -> List[str]:
+        """List ids of messages matching the query, following pages up to max_results"""
+        message_ids = []
+        page_token = None
+        
+        while len(message_ids) < max_results:
+            results = self.service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=min(max_results - len(message_ids), LIST_PAGE_SIZE),
+                pageToken=page_token
+            ).execute()
+            
+            message_ids.extend(message['id'] for message in results.get('messages', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        
+        return message_ids
+    
+    def iter_emails(self, query: str = "", max_results: int = 50, summarize: bool = True) -> Iterator[Dict]:
+        """Yield analyzed emails in inbox order as soon as their summaries are ready"""
+        if not self.service:
+            self.error_handler("Gmail service not initialized. Please authenticate first.")
+            return
+        
+        try:
+            with GmailAISummarizer._service_lock:
+                message_ids = self._list_message_ids(query, max_results)
+                # Without summaries only the headers are needed
+                fetched = self._batch_get_messages(message_ids, metadata_only=not summarize)
+            parsed = [(message_id, *fetched[message_id]) for message_id in message_ids if message_id in fetched]
+            
+            # AI summarization, batches complete in any order
+            summaries = self._iter_summaries(
+                [(message_id, content, subject) for message_id, content, subject, _, _ in parsed]
+            )
+            ready = {}
+            next_index = 0
+            
+            while next_index < len(parsed):
+                if summarize:
+                    i, ai_summary = self._run(summaries.__anext__())
+                else:
+                    i, ai_summary = next_index, self._empty_summary('AI summary not requested')
+                ready[i] = ai_summary
+                
+                # Release every email whose predecessors are all done
+                while next_index in ready:
+                    message_id, content, subject, sender, date = parsed[next_index]
+                    ai_summary = ready.pop(next_index)
+                    next_index += 1
+                    urls = self.extract_urls_from_text(content)
+                    
+                    yield {
+                        'id': message_id,
+                        'subject': subject,
+                        'sender': sender,
+                        'date': date,
+                        'ts': self._parse_date(date),
+                        'content': content[:500] + "..." if len(content) > 500 else content,
+                        'urls': urls,
+                        'url_domains': [url_domain(url) for url in urls],
+                        'summary': ai_summary['summary'],
+                        'key_points': ai_summary['key_points'],
+                        'action_items': ai_summary['action_items'],
+                        'sentiment': ai_summary['sentiment'],
+                        # Set when summarizing failed, so callers know not to keep the result
+                        'summary_failed': ai_summary.get('failed', False)
+                    }
+            
+        except Exception as e:
+            self.error_handler(f"Error fetching emails: {e}")
+    
+    def fetch_emails(self, query: str = "", max_results: int = 50, summarize: bool = True) -> List[Dict]:
+        """Fetch emails based on query"""
+        return list(self.iter_emails(query, max_results, summarize))
+    
+    def get_date_range_query(self, start_date: str, end_date: str) -> str:
+        """Create Gmail query for date range"""
+        return f"after:{start_date} before:{end_date}"
+    
+    def create_digest(self, emails: List[Dict]) -> Dict:
+        """Create a comprehensive digest of emails"""
+        if not emails:
+            return {}
+        
+        # Unique URLs and all action items
+        unique_urls = set(chain.from_iterable(email['urls'] for email in emails))
+        all_action_items = list(chain.from_iterable(email['action_items'] for email in emails))
+        
+        # Count sentiments and senders
+        sentiment_counts = Counter(email['sentiment'] for email in emails)
+        sender_counts = Counter(email['sender'] for email in emails)
+        
+        return {
+            'total_emails': len(emails),
+            'unique_urls': list(unique_urls),
+            'sentiment_distribution': dict(sentiment_counts),
+            'action_items': all_action_items,
+            'top_senders': sender_counts.most_common(5),
+            'date_range': {
+                'start': emails[-1]['date'] if emails else None,
+                'end': emails[0]['date'] if emails else None
+            }
+        }
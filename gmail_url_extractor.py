@@ -5,31 +5,65 @@ Extracts URLs and basic email information from Gmail
 """
 
 import os
-import base64
 import re
+import threading
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple
-import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+from typing import Iterable, List, Dict, Optional, Set, Tuple
 
 import streamlit as st
 import pandas as pd
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from bs4 import BeautifulSoup
+import diskcache
+from selectolax.parser import HTMLParser
 from dotenv import load_dotenv
 
+from gmail_core import (batch_get_messages, build_service, decode_body, extract_urls,
+                        get_message_request, parse_headers, url_domain)
+
 # Load environment variables
 load_dotenv()
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Partial response mask, only the headers and text bodies are read, up to three MIME levels deep
+MESSAGE_PART_FIELDS = 'mimeType,body/data'
+MESSAGE_FIELDS = (
+    f'id,payload(headers(name,value),{MESSAGE_PART_FIELDS},'
+    f'parts({MESSAGE_PART_FIELDS},parts({MESSAGE_PART_FIELDS},parts({MESSAGE_PART_FIELDS}))))'
+)
+
+# On-disk cache of parsed messages, bump the parser version when parsing changes
+MESSAGE_CACHE_DIR = '.messagecache'
+MESSAGE_CACHE_EXPIRE = 30 * 24 * 60 * 60
+MESSAGE_PARSER_VERSION = "v5"
+
+# Characters of cleaned text kept per email, enough for the content preview
+PREVIEW_CHARS = 500
+
+# Runs of non-whitespace, matched lazily so previews can stop early
+WORD_PATTERN = re.compile(r'\S+')
+
+# Parsed message: preview text, subject, sender, date and (url, domain) pairs
+ParsedMessage = Tuple[str, str, str, str, List[Tuple[str, str]]]
+
+# Threads used to fetch messages one by one when a batch request fails
+MAX_FETCH_THREADS = 10
+
 class GmailURLExtractor:
     def __init__(self):
         self.service = None
+        self.creds = None
+        # Opened on first fetch
+        self._message_cache = None
+        # httplib2 isn't thread-safe, fallback threads each build their own service
+        self._thread_local = threading.local()
     
     def authenticate_gmail(self):
         """Authenticate with Gmail API"""
@@ -65,7 +99,8 @@ class GmailURLExtractor:
                 token.write(creds.to_json())
         
         try:
-            self.service = build('gmail', 'v1', credentials=creds)
+            self.service = build_service(creds)
+            self.creds = creds
             return True
         except Exception as e:
             st.error(f"Error building Gmail service: {e}")
@@ -73,69 +108,154 @@ class GmailURLExtractor:
     
     def extract_urls_from_text(self, text: str) -> List[str]:
         """Extract URLs from text content"""
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        urls = re.findall(url_pattern, text)
-        return list(set(urls))  # Remove duplicates
-    
-    def clean_email_content(self, content: str) -> str:
-        """Clean and extract text content from email"""
-        if not content:
-            return ""
+        return extract_urls(text)
+    
+    def extract_urls_with_domains(self, text: str) -> List[Tuple[str, str]]:
+        """Extract unique URLs from text content, each paired with its domain"""
+        return [(url, url_domain(url)) for url in extract_urls(text)]
+    
+    def _parse_html(self, content: bytes, max_chars: Optional[int] = None) -> Tuple[str, Set[str]]:
+        """Text of an HTML body, stopping once past max_chars, and every URL it links to or mentions"""
+        # The parser takes bytes directly and detects the charset itself
+        tree = HTMLParser(content)
         
-        # Decode base64 if needed
-        try:
-            content = base64.urlsafe_b64decode(content).decode('utf-8')
-        except:
-            pass
+        # Remove script and style elements
+        for node in tree.css('script, style'):
+            node.decompose()
         
-        # Parse HTML and extract text
-        soup = BeautifulSoup(content, 'html.parser')
+        # Most URLs sit in link and image attributes, which the parser has already unescaped
+        urls = set()
+        for node in tree.css('a[href], img[src]'):
+            url = (node.attributes.get('href') or node.attributes.get('src') or '').strip()
+            if url.startswith(('http://', 'https://')):
+                urls.add(url)
         
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
+        # The rest are written out in the text, so only text nodes need the regex
+        root = tree.body or tree.root
+        texts = [node.text_content for node in root.traverse(include_text=True)
+                 if node.tag == '-text'] if root else []
+        for text in texts:
+            if 'http' in text:
+                urls.update(extract_urls(text))
         
-        # Get text content
-        text = soup.get_text()
+        return self._collapse_whitespace(texts, max_chars), urls
+    
+    @staticmethod
+    def _collapse_whitespace(chunks: Iterable[str], max_chars: Optional[int] = None) -> str:
+        """Join the words in chunks with single spaces, stopping once past max_chars"""
+        if max_chars is None:
+            return ' '.join(' '.join(chunks).split())
         
-        # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
+        words = []
+        length = -1
+        for chunk in chunks:
+            for match in WORD_PATTERN.finditer(chunk):
+                words.append(match.group(0))
+                length += len(words[-1]) + 1
+                if length > max_chars:
+                    return ' '.join(words)
+        return ' '.join(words)
+    
+    def _parse_message(self, message: Dict, metadata_only: bool = False) -> ParsedMessage:
+        """Extract content, subject, sender, date and URLs from a fetched message"""
+        subject, sender, date = parse_headers(message)
         
-        return text
+        if metadata_only:
+            return "", subject, sender, date, []
+        
+        raw, is_html = decode_body(message['payload'])
+        
+        # Only the preview is cleaned, URLs come from the whole body
+        if not raw:
+            cleaned_content, url_domains = "", []
+        elif is_html:
+            cleaned_content, urls = self._parse_html(raw, max_chars=PREVIEW_CHARS)
+            url_domains = [(url, url_domain(url)) for url in urls]
+        else:
+            text = raw.decode('utf-8', errors='replace')
+            cleaned_content = self._collapse_whitespace([text], max_chars=PREVIEW_CHARS)
+            url_domains = self.extract_urls_with_domains(text)
+        return cleaned_content, subject, sender, date, url_domains
     
-    def get_email_content(self, message_id: str) -> Tuple[str, str, str, str]:
-        """Get email content, subject, sender, and date"""
+    def get_email_content(self, message_id: str) -> ParsedMessage:
+        """Get email content, subject, sender, date and URLs, from the disk cache when possible"""
         try:
-            message = self.service.users().messages().get(userId='me', id=message_id).execute()
-            
-            headers = message['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-            
-            # Extract body content
-            body = ""
-            if 'parts' in message['payload']:
-                for part in message['payload']['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        body = part['body'].get('data', '')
-                        break
-                    elif part['mimeType'] == 'text/html':
-                        body = part['body'].get('data', '')
-            else:
-                body = message['payload']['body'].get('data', '')
-            
-            cleaned_content = self.clean_email_content(body)
-            return cleaned_content, subject, sender, date
+            # A failed fetch has already been reported by the batch callback
+            return self._get_messages([message_id])[0].get(message_id, ("", "", "", "", []))
             
         except Exception as e:
             st.error(f"Error getting email content: {e}")
-            return "", "", "", ""
+            return "", "", "", "", []
+    
+    def _batch_get_messages(self, message_ids: List[str],
+                            metadata_only: bool = False) -> Dict[str, ParsedMessage]:
+        """Fetch and parse messages, up to BATCH_SIZE per HTTP round-trip, concurrently if batching fails"""
+        # Fallback threads build their own services, which needs the credentials
+        fallback = None
+        if self.creds is not None:
+            fallback = partial(self._threaded_get_messages, metadata_only=metadata_only)
+        
+        return batch_get_messages(
+            self.service,
+            {message_id: get_message_request(self.service, message_id, metadata_only, MESSAGE_FIELDS)
+             for message_id in message_ids},
+            partial(self._parse_message, metadata_only=metadata_only),
+            st.error,
+            fallback
+        )
+    
+    def _fetch_message(self, message_id: str, metadata_only: bool = False) -> ParsedMessage:
+        """Fetch and parse one message with this thread's own Gmail service"""
+        service = getattr(self._thread_local, 'service', None)
+        if service is None:
+            service = build_service(self.creds)
+            self._thread_local.service = service
+        message = get_message_request(service, message_id, metadata_only, MESSAGE_FIELDS).execute()
+        return self._parse_message(message, metadata_only)
+    
+    def _threaded_get_messages(self, message_ids: List[str],
+                               metadata_only: bool = False) -> Dict[str, ParsedMessage]:
+        """Fetch and parse messages one request each, spread over a thread pool"""
+        with ThreadPoolExecutor(max_workers=MAX_FETCH_THREADS) as executor:
+            futures = {message_id: executor.submit(self._fetch_message, message_id, metadata_only)
+                       for message_id in message_ids}
+        
+        # Errors are reported here, st calls from worker threads are dropped
+        parsed = {}
+        for message_id, future in futures.items():
+            try:
+                parsed[message_id] = future.result()
+            except Exception as e:
+                st.error(f"Error getting email content: {e}")
+        return parsed
     
-    def fetch_emails(self, query: str = "", max_results: int = 50) -> List[Dict]:
-        """Fetch emails based on query"""
+    def _get_messages(self, message_ids: List[str],
+                      metadata_only: bool = False) -> Tuple[Dict[str, ParsedMessage], Set[str]]:
+        """Parsed messages by id, fetching only those not already cached on disk, and the ids parsed in full"""
+        if self._message_cache is None:
+            self._message_cache = diskcache.Cache(MESSAGE_CACHE_DIR)
+        
+        # Messages never change once sent, so a cached parse stays valid, and a full parse also serves headers
+        parsed = {}
+        for message_id in message_ids:
+            cached = self._message_cache.get(f"{message_id}:{MESSAGE_PARSER_VERSION}")
+            if cached is not None:
+                parsed[message_id] = cached
+        
+        missing = [message_id for message_id in message_ids if message_id not in parsed]
+        fetched = self._batch_get_messages(missing, metadata_only)
+        if not metadata_only:
+            for message_id, message in fetched.items():
+                self._message_cache.set(f"{message_id}:{MESSAGE_PARSER_VERSION}", message,
+                                        expire=MESSAGE_CACHE_EXPIRE)
+        
+        # Cache hits are full parses even when only headers were asked for
+        full_ids = set(parsed) if metadata_only else set(parsed) | set(fetched)
+        parsed.update(fetched)
+        return parsed, full_ids
+    
+    def fetch_emails(self, query: str = "", max_results: int = 50, load_content: bool = True) -> List[Dict]:
+        """Fetch emails based on query, only their headers unless load_content is set"""
         if not self.service:
             st.error("Gmail service not initialized. Please authenticate first.")
             return []
@@ -148,70 +268,93 @@ class GmailURLExtractor:
             ).execute()
             
             messages = results.get('messages', [])
-            emails = []
-            
-            for message in messages:
-                content, subject, sender, date = self.get_email_content(message['id'])
-                urls = self.extract_urls_from_text(content)
-                
-                email_data = {
-                    'id': message['id'],
-                    'subject': subject,
-                    'sender': sender,
-                    'date': date,
-                    'content': content[:500] + "..." if len(content) > 500 else content,
-                    'urls': urls,
-                    'url_count': len(urls)
-                }
-                emails.append(email_data)
-            
-            return emails
+            fetched, full_ids = self._get_messages([message['id'] for message in messages],
+                                                   metadata_only=not load_content)
+            return [self.build_email(message['id'], fetched[message['id']], message['id'] in full_ids)
+                    for message in messages if message['id'] in fetched]
             
         except Exception as e:
             st.error(f"Error fetching emails: {e}")
             return []
     
+    def build_email(self, message_id: str, parsed: ParsedMessage, content_loaded: bool = True) -> Dict:
+        """Email record shown in the UI, built from a parsed message"""
+        content, subject, sender, date, url_domains = parsed
+        urls = [url for url, _ in url_domains]
+        preview = content[:PREVIEW_CHARS] + "..." if len(content) > PREVIEW_CHARS else content
+        
+        return {
+            'id': message_id,
+            'subject': subject,
+            'sender': sender,
+            'date': date,
+            'content': preview,
+            'content_loaded': content_loaded,
+            # Lowercased once here so searching doesn't redo it on every keystroke
+            'search_text': f"{subject}\n{sender}\n{preview}".lower(),
+            'urls': urls,
+            'domains': [domain for _, domain in url_domains],
+            'url_count': len(urls)
+        }
+    
     def get_date_range_query(self, start_date: str, end_date: str) -> str:
         """Create Gmail query for date range"""
         return f"after:{start_date} before:{end_date}"
     
-    def create_digest(self, emails: List[Dict]) -> Dict:
-        """Create a comprehensive digest of emails"""
+    def count_emails(self, emails: List[Dict]) -> Dict[str, Counter]:
+        """Sender, URL and domain counts, which can be added to or subtracted from running totals"""
+        return {
+            'senders': Counter(email['sender'] for email in emails),
+            'urls': Counter(chain.from_iterable(email['urls'] for email in emails)),
+            'domains': Counter(chain.from_iterable(email['domains'] for email in emails))
+        }
+    
+    def create_digest(self, emails: List[Dict], counts: Optional[Dict[str, Counter]] = None) -> Dict:
+        """Create a comprehensive digest of emails, from running counts when given"""
         if not emails:
             return {}
         
-        # Extract all URLs
-        all_urls = []
-        for email in emails:
-            all_urls.extend(email['urls'])
-        
-        # Top senders
-        sender_counts = {}
-        for email in emails:
-            sender = email['sender']
-            sender_counts[sender] = sender_counts.get(sender, 0) + 1
-        
-        # URL domains
-        url_domains = {}
-        for url in all_urls:
-            try:
-                domain = urllib.parse.urlparse(url).netloc
-                url_domains[domain] = url_domains.get(domain, 0) + 1
-            except:
-                pass
+        # Unary plus drops entries that were subtracted down to zero
+        counts = counts or self.count_emails(emails)
+        url_counts = +counts['urls']
         
         return {
             'total_emails': len(emails),
-            'unique_urls': list(set(all_urls)),
-            'total_urls': len(all_urls),
-            'top_senders': sorted(sender_counts.items(), key=lambda x: x[1], reverse=True)[:5],
-            'url_domains': sorted(url_domains.items(), key=lambda x: x[1], reverse=True)[:10],
+            'unique_urls': list(url_counts),
+            'total_urls': sum(url_counts.values()),
+            'top_senders': (+counts['senders']).most_common(5),
+            'url_domains': (+counts['domains']).most_common(10),
             'date_range': {
                 'start': emails[-1]['date'] if emails else None,
                 'end': emails[0]['date'] if emails else None
             }
         }
 
+def store_emails(extractor: GmailURLExtractor, emails: List[Dict],
+                 replaced: Optional[Tuple[int, Dict]] = None):
+    """Keep fetched emails, their digest and a searchable DataFrame for later reruns"""
+    st.session_state.emails = emails
+    
+    # replaced is the (index, previous record) of one changed email, only its share is redone
+    if replaced is None:
+        counts = extractor.count_emails(emails)
+        
+        # Arrow-backed search column, filtered with vectorized str.contains
+        emails_df = pd.DataFrame({'search_text': [email['search_text'] for email in emails]})
+        emails_df['search_text'] = emails_df['search_text'].astype('string[pyarrow]')
+        st.session_state.emails_df = emails_df
+    else:
+        index, previous = replaced
+        counts = st.session_state.digest_counts
+        for name, counter in extractor.count_emails([previous]).items():
+            counts[name].subtract(counter)
+        for name, counter in extractor.count_emails([emails[index]]).items():
+            counts[name].update(counter)
+        st.session_state.emails_df.loc[index, 'search_text'] = emails[index]['search_text']
+    
+    st.session_state.digest_counts = counts
+    st.session_state.digest = extractor.create_digest(emails, counts)
+
 def main():
     st.set_page_config(
         page_title="Gmail URL Extractor",
@@ -269,6 +412,11 @@ def main():
     )
     
     max_results = st.sidebar.slider("Max emails to fetch:", 10, 100, 50)
+    load_content = st.sidebar.checkbox(
+        "📄 Load email content",
+        value=True,
+        help="Turn off to fetch only headers, each email's content and URLs can then be loaded from the Email List"
+    )
     
     query = ""
     if fetch_option == "Date range":
@@ -291,20 +439,25 @@ def main():
         with st.spinner("Fetching emails and extracting URLs..."):
             # Use the authenticated extractor from session state
             if hasattr(st.session_state, 'extractor'):
-                emails = st.session_state.extractor.fetch_emails(query, max_results)
+                emails = st.session_state.extractor.fetch_emails(query, max_results, load_content)
             else:
-                emails = extractor.fetch_emails(query, max_results)
+                emails = extractor.fetch_emails(query, max_results, load_content)
             
             if emails:
-                st.session_state.emails = emails
-                st.session_state.digest = extractor.create_digest(emails)
-                st.success(f"✅ Fetched {len(emails)} emails and extracted URLs!")
+                store_emails(extractor, emails)
+                # A plain fetch isn't a Gmail search, the search box filters it locally again
+                st.session_state.gmail_search_term = None
+                if load_content:
+                    st.success(f"✅ Fetched {len(emails)} emails and extracted URLs!")
+                else:
+                    st.success(f"✅ Fetched {len(emails)} email headers!")
             else:
                 st.error("No emails found or error occurred.")
     
     # Display results
     if hasattr(st.session_state, 'emails') and st.session_state.emails:
         emails = st.session_state.emails
+        emails_df = st.session_state.emails_df
         digest = st.session_state.digest
         
         # Tabs for different views
@@ -350,20 +503,46 @@ def main():
             
             filtered_emails = emails
             if search_term:
-                filtered_emails = [
-                    email for email in emails
-                    if search_term.lower() in email['subject'].lower() or
-                       search_term.lower() in email['sender'].lower() or
-                       search_term.lower() in email['content'].lower()
-                ]
+                # Gmail already matched its results against this term, including body text and operators
+                if search_term != st.session_state.get('gmail_search_term'):
+                    mask = emails_df['search_text'].str.contains(search_term.lower(), na=False, regex=False)
+                    filtered_emails = [emails[i] for i in emails_df.index[mask]]
+                
+                # Search the whole mailbox with Gmail's index, not just the fetched emails
+                if st.button("🔎 Search in Gmail"):
+                    with st.spinner("Searching Gmail..."):
+                        gmail_extractor = st.session_state.get('extractor', extractor)
+                        found = gmail_extractor.fetch_emails(f"{query} {search_term}".strip(), max_results,
+                                                             load_content)
+                    
+                    if found:
+                        store_emails(extractor, found)
+                        st.session_state.gmail_search_term = search_term
+                        st.rerun()
+                    else:
+                        st.error("No emails found in Gmail for this search.")
             
             for i, email in enumerate(filtered_emails):
-                with st.expander(f"📧 {email['subject']} - {email['sender']} ({email['url_count']} URLs)"):
+                url_label = f"{email['url_count']} URLs" if email['content_loaded'] else "content not loaded"
+                with st.expander(f"📧 {email['subject']} - {email['sender']} ({url_label})"):
                     col1, col2 = st.columns([2, 1])
                     
                     with col1:
                         st.write(f"**From:** {email['sender']}")
                         st.write(f"**Date:** {email['date']}")
+                        
+                        # Expander bodies always run, so the content is fetched only on request
+                        if not email['content_loaded']:
+                            if st.button("📄 Load content", key=f"load_{email['id']}"):
+                                gmail_extractor = st.session_state.get('extractor', extractor)
+                                parsed = gmail_extractor.get_email_content(email['id'])
+                                if parsed[1]:
+                                    index = next(j for j, e in enumerate(emails) if e['id'] == email['id'])
+                                    emails[index] = extractor.build_email(email['id'], parsed)
+                                    store_emails(extractor, emails, replaced=(index, email))
+                                    st.rerun()
+                            continue
+                        
                         st.write(f"**URLs found:** {email['url_count']}")
                         
                         st.subheader("Content Preview")
@@ -6,7 +6,7 @@ This script helps you set up Gmail API credentials for the AI Summarizer tool.
 
 import os
 import webbrowser
-import json
+import orjson
 from pathlib import Path
 
 def print_step(step_num, title, description):
@@ -69,8 +69,8 @@ def main():
         
         # Validate the file
         try:
-            with open('credentials.json', 'r') as f:
-                creds = json.load(f)
+            with open('credentials.json', 'rb') as f:
+                creds = orjson.loads(f.read())
             
             if 'installed' in creds or 'web' in creds:
                 print("✅ Credentials file appears to be valid!")
@@ -81,7 +81,7 @@ def main():
             else:
                 print("❌ Credentials file format seems incorrect.")
                 print("Please ensure you downloaded the OAuth 2.0 client credentials.")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             print("❌ Invalid JSON file. Please check your credentials.json file.")
     else:
         print("❌ credentials.json not found in the current directory.")
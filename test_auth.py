@@ -5,7 +5,7 @@ Test script to verify Gmail authentication
 
 import os
 from dotenv import load_dotenv
-from gmail_ai_summarizer import GmailAISummarizer
+from gmail_core import GmailAISummarizer
 
 def test_authentication():
     """Test Gmail authentication"""